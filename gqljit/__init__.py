@@ -6,17 +6,24 @@ References:
 - https://adventures.michaelfbryan.com/posts/ffi-safe-polymorphism-in-rust/
 """
 
+import contextlib
 import ctypes
 import itertools
+import sys
+import threading
+import time
 import typing as t
-from dataclasses import dataclass
+from dataclasses import dataclass, field as dataclass_field
 
 from llvmlite import ir, binding as llvm
+from graphql.error import GraphQLError, located_error
 from graphql.execution import ExecutionContext
-from graphql.language.ast import FieldNode
+from graphql.language import Source, SourceLocation
+from graphql.language.ast import FieldNode, IntValueNode, VariableNode
 from graphql.pyutils.path import Path
 from graphql.type import (
     GraphQLObjectType,
+    is_list_type,
     is_non_null_type,
     is_scalar_type,
     get_nullable_type,
@@ -24,20 +31,54 @@ from graphql.type import (
 )
 
 from . import _pyapi
+from ._introspection import (
+    IntrospectionCache,
+    IntrospectionResult,
+    introspect,
+    is_introspection_field,
+    operation_key,
+    schema_fingerprint,
+)
+from ._lazy import LazyExecutionResult, LazyResult, Shape, _Deferred
 from ._utils import once, cstr
 
 __all__ = [
     "Field",
     "ScalarField",
+    "ConstantField",
     "ObjectField",
+    "QueryCost",
     "JITExecutionContext",
     "Compiler",
+    "CompiledQuery",
+    "CompileStats",
+    "LazyResult",
+    "IntrospectionCache",
+    "IntrospectionResult",
+    "introspect",
+    "schema_fingerprint",
 ]
 
 _bool_ty = ir.IntType(1)
 _char_p = ir.IntType(8).as_pointer()
+_i8 = ir.IntType(8)
 _i32 = ir.IntType(32)
 
+# llvmlite's binding layer shares global LLVM state (e.g. the context used by
+# parse_assembly), so every call into it is serialized. Building the IR is
+# pure Python and per-Compiler, so that part can run concurrently.
+_llvm_lock = threading.RLock()
+
+# Status of a slot in a result struct (see Compiler._get_result_struct)
+_FIELD_UNSET = 0
+_FIELD_VALUE = 1
+_FIELD_NULL = 2
+_FIELD_ERROR = 3
+
+
+def _symbol(prefix: str, path: tuple[int | str, ...]) -> str:
+    return f"{prefix}_{'.'.join(map(str, path))}"
+
 
 @once
 def _init_llvm_bindings() -> None:
@@ -51,6 +92,10 @@ class Field:
     name: str
     resolver: t.Optional[t.Callable[..., t.Any]]
     nullable: bool
+    # The node the field was selected by, used to locate errors
+    node: t.Optional[FieldNode] = dataclass_field(
+        default=None, kw_only=True, compare=False
+    )
 
 
 @dataclass
@@ -58,26 +103,115 @@ class ScalarField(Field):
     pass
 
 
+@dataclass
+class ConstantField(ScalarField):
+    """A scalar whose value is known when the query is compiled, such as
+    ``__typename``."""
+
+    value: t.Any
+
+
+@dataclass(frozen=True)
+class QueryCost:
+    """Static estimate of how expensive a selection is to execute.
+
+    ``field_count`` and ``depth`` describe the query as written. The
+    estimates multiply each object's sub-selection by its ``multiplicity``,
+    which is only ever above 1 for list fields. Since lists aren't supported
+    yet, for now the estimates match the query as written.
+    Only fields with a resolver of their own count as resolver calls, since
+    the default resolver runs in native code.
+    """
+
+    field_count: int
+    depth: int
+    estimated_fields: int
+    resolver_calls: int
+
+    @classmethod
+    def of_selection(cls, selection: t.Dict[str, Field]) -> "QueryCost":
+        field_count = depth = estimated_fields = resolver_calls = 0
+
+        for field in selection.values():
+            # The field itself is resolved once per parent object
+            field_count += 1
+            estimated_fields += 1
+            if field.resolver is not None:
+                resolver_calls += 1
+            if isinstance(field, ObjectField):
+                field_count += field.cost.field_count
+                depth = max(depth, field.cost.depth)
+                estimated_fields += field.multiplicity * field.cost.estimated_fields
+                resolver_calls += field.multiplicity * field.cost.resolver_calls
+
+        return cls(
+            field_count=field_count,
+            depth=depth + 1,
+            estimated_fields=estimated_fields,
+            resolver_calls=resolver_calls,
+        )
+
+
 @dataclass
 class ObjectField(Field):
     selection: t.Dict[str, Field]
+    # Estimated number of objects the field resolves to, from the first, last
+    # or limit argument of a list field
+    multiplicity: int = 1
+    cost: QueryCost = dataclass_field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.cost = QueryCost.of_selection(self.selection)
+
+
+# Arguments taken as a hint of how many items a field resolves to
+_multiplicity_arguments = ("first", "last", "limit")
 
 
 def convert_graphql_query(
-    root_type: GraphQLObjectType, fields: t.List[FieldNode]
+    root_type: GraphQLObjectType,
+    fields: t.List[FieldNode],
+    variable_values: t.Optional[t.Dict[str, t.Any]] = None,
 ) -> ObjectField:
+    def _multiplicity(field: FieldNode) -> int:
+        for argument in field.arguments or ():
+            if argument.name.value not in _multiplicity_arguments:
+                continue
+            value: t.Any = None
+            if isinstance(argument.value, IntValueNode):
+                value = int(argument.value.value)
+            elif isinstance(argument.value, VariableNode) and variable_values:
+                value = variable_values.get(argument.value.name.value)
+            if isinstance(value, int) and value >= 0:
+                return value
+        return 1
+
     def _convert_graphql_query(
         root_type: GraphQLObjectType, fields: t.List[FieldNode]
     ) -> t.Dict[str, Field]:
-        selection = {}
+        selection: t.Dict[str, Field] = {}
 
         for field in fields:
             name = field.name.value
             alias = field.alias.value if field.alias else name
+            if name == "__typename":
+                selection[alias] = ConstantField(
+                    name=name,
+                    resolver=None,
+                    nullable=False,
+                    value=root_type.name,
+                    node=field,
+                )
+                continue
             field_def = root_type.fields[name]
             type_ = field_def.type
             resolver = field_def.resolve
             nullable = True
+            # Only a list can resolve to more than one object. Lists can't be
+            # lowered yet, so for now this is always 1.
+            multiplicity = (
+                _multiplicity(field) if is_list_type(get_nullable_type(type_)) else 1
+            )
 
             if is_non_null_type(type_):
                 type_ = get_nullable_type(type_)
@@ -90,6 +224,7 @@ def convert_graphql_query(
                     name=name,
                     resolver=resolver,
                     nullable=nullable,
+                    node=field,
                 )
             elif is_object_type(type_):
                 assert field.selection_set is not None
@@ -100,6 +235,8 @@ def convert_graphql_query(
                     selection=_convert_graphql_query(
                         type_, field.selection_set.selections
                     ),
+                    multiplicity=multiplicity,
+                    node=field,
                 )
             else:
                 raise NotImplementedError(type_)
@@ -117,6 +254,18 @@ def convert_graphql_query(
 
 
 class JITExecutionContext(ExecutionContext):
+    # Lower each selection to a fixed-layout native struct instead of filling a
+    # dict per object; see Compiler.
+    struct_results = False
+    # Return a LazyResult whose nested objects are only executed on access
+    lazy_results = False
+    # Answer introspection-only operations from a per-schema IntrospectionCache
+    cache_introspection = True
+    # LLVM optimization level for compiled queries
+    opt_level = 0
+    # Deepest query that will be compiled, or None for no limit
+    max_depth: t.Optional[int] = 128
+
     def execute_fields(
         self,
         parent_type: GraphQLObjectType,
@@ -124,55 +273,393 @@ class JITExecutionContext(ExecutionContext):
         path: t.Optional[Path],
         fields: t.Dict[str, t.List[FieldNode]],
     ):
+        if path is not None:
+            # The compiled code executes the whole query in one call, so this
+            # only happens while graphql-core fills the introspection cache.
+            return super().execute_fields(parent_type, source_value, path, fields)
+        if self.cache_introspection and all(
+            is_introspection_field(field.name.value) for (field,) in fields.values()
+        ):
+            return self._execute_introspection(parent_type, source_value, fields)
+        if any(
+            is_introspection_field(field.name.value)
+            and field.name.value != "__typename"
+            for (field,) in fields.values()
+        ):
+            # __schema and __type can't be compiled, so graphql-core executes
+            # the whole operation
+            return super().execute_fields(parent_type, source_value, path, fields)
+
         # FIXME: Cache the compiled queries
-        selection = convert_graphql_query(
-            parent_type, [field for (field,) in fields.values()]
+        compiler = Compiler(
+            struct_results=self.struct_results,
+            lazy_results=self.lazy_results,
+            opt_level=self.opt_level,
+            max_depth=self.max_depth,
         )
-        compiler = Compiler()
+        selection = compiler.lower(
+            parent_type,
+            [field for (field,) in fields.values()],
+            self.variable_values,
+        )
+        self.check_cost(selection.cost)
         resolver = compiler.compile(selection)
         return resolver(source_value, None, self.errors)
 
+    def _execute_introspection(
+        self,
+        parent_type: GraphQLObjectType,
+        source_value: t.Any,
+        fields: t.Dict[str, t.List[FieldNode]],
+    ):
+        data = None
+        errors_before = len(self.errors)
+
+        def compute():
+            nonlocal data
+            data = super(JITExecutionContext, self).execute_fields(
+                parent_type, source_value, None, fields
+            )
+            if len(self.errors) != errors_before or self.is_awaitable(data):
+                return None
+            return data
+
+        key = operation_key(self.operation, self.variable_values)
+        if key is None:
+            return compute()
+        result = IntrospectionCache.for_schema(self.schema).get(key, compute)
+        return data if result is None else result.data
+
+    def check_cost(self, cost: QueryCost) -> None:
+        """Called with the cost of the query before it is compiled.
+
+        Override this to reject expensive queries by raising a GraphQLError.
+        """
+
+    def build_response(self, data):
+        if isinstance(data, LazyResult):
+            # Deferred objects can still add errors after this returns, so the
+            # result has to keep the list itself even while it's empty.
+            return LazyExecutionResult(data, self.errors)
+        return super().build_response(data)
+
+
+@dataclass(frozen=True)
+class CompileStats:
+    """What it took to compile a query, and what came out.
+
+    ``timings`` maps each phase that ran to the seconds it took, in order:
+    ``lowering`` (only if the query went through ``Compiler.lower``),
+    ``ir_build``, ``parse_verify``, ``optimize`` and ``finalize``.
+    ``code_size`` is the size in bytes of the object code MCJIT emitted.
+    """
+
+    timings: t.Dict[str, float]
+    code_size: int
+    function_count: int
+
+    @property
+    def total_time(self) -> float:
+        return sum(self.timings.values())
+
+
+class CompiledQuery:
+    """A query compiled by ``Compiler.compile``.
+
+    Calling it executes the query on ``root``, adding any field errors to
+    ``errors``. It keeps the compiler, and so the machine code, alive and
+    holds no mutable state, so one instance can be shared between threads.
+
+    ``cost`` is the static cost estimate of the compiled selection, and
+    ``stats`` describes its compilation.
+    """
+
+    __slots__ = ("_compiler", "_execute", "_lazy_shape", "cost", "stats")
+
+    def __init__(
+        self,
+        compiler: "Compiler",
+        execute: t.Callable[[t.Any, t.Any, t.List[t.Any]], t.Any],
+        *,
+        lazy_shape: t.Optional[Shape],
+        cost: QueryCost,
+        stats: CompileStats,
+    ):
+        self._compiler = compiler
+        self._execute = execute
+        # Which fields are objects, if results are returned as LazyResults
+        self._lazy_shape = lazy_shape
+        self.cost = cost
+        self.stats = stats
+
+    @property
+    def compiler(self) -> "Compiler":
+        """The compiler that produced this query, to inspect its output."""
+        return self._compiler
+
+    def __call__(self, root, info, errors, *args, **kwargs):
+        result = self._execute(root, info, errors)
+        if self._lazy_shape is not None and result is not None:
+            return LazyResult(result, info, errors, self._lazy_shape)
+        return result
+
+
+def _shape_of(selection: ObjectField) -> Shape:
+    return {
+        alias: _shape_of(field)
+        for alias, field in selection.selection.items()
+        if isinstance(field, ObjectField)
+    }
+
+
+# Attributes of an exception that located_error takes over those of the field
+# that raised it
+_located_error_attributes = frozenset(("message", "source", "positions", "nodes"))
+_plain_exception_types: t.Dict[type, bool] = {}
+
+
+def _is_plain_exception(exc: Exception) -> bool:
+    """Whether ``exc`` has none of ``_located_error_attributes``."""
+    exc_type = type(exc)
+    plain = _plain_exception_types.get(exc_type)
+    if plain is None:
+        plain = _plain_exception_types[exc_type] = not issubclass(
+            exc_type, GraphQLError
+        ) and not any(hasattr(exc_type, name) for name in _located_error_attributes)
+    return plain and exc.__dict__.keys().isdisjoint(_located_error_attributes)
+
+
+@dataclass(frozen=True)
+class _ErrorSite:
+    """Where an error raised by a field's resolver is located.
+
+    Everything but the message is the same for every error the field raises,
+    so it's computed once when the query is compiled rather than by
+    ``located_error`` for every error. Each error still gets its own lists.
+    """
+
+    path: t.Tuple[t.Union[str, int], ...]
+    nodes: t.Tuple[FieldNode, ...]
+    source: t.Optional[Source]
+    positions: t.Tuple[int, ...]
+    locations: t.Tuple[SourceLocation, ...]
+
+    @classmethod
+    def of_field(
+        cls, field: Field, path: t.Tuple[t.Union[str, int], ...]
+    ) -> "_ErrorSite":
+        if field.node is None:
+            return cls(path=path, nodes=(), source=None, positions=(), locations=())
+        loc = field.node.loc
+        if loc is None:
+            return cls(
+                path=path, nodes=(field.node,), source=None, positions=(), locations=()
+            )
+        return cls(
+            path=path,
+            nodes=(field.node,),
+            source=loc.source,
+            positions=(loc.start,),
+            locations=(loc.source.get_location(loc.start),),
+        )
+
+    def locate(self, exc: Exception) -> GraphQLError:
+        """Make the same GraphQLError as ``located_error`` would for ``exc``."""
+        if not _is_plain_exception(exc):
+            return located_error(exc, list(self.nodes) or None, list(self.path))
+
+        # Created without nodes, so graphql-core doesn't work out the location
+        # again for every error, then given the precomputed one
+        error = GraphQLError(str(exc), path=list(self.path), original_error=exc)
+        error.nodes = list(self.nodes) or None
+        error.source = self.source
+        error.positions = list(self.positions) or None
+        error.locations = list(self.locations) or None
+        return error
+
 
 class Compiler:
-    def __init__(self):
+    """Compiles a query into native code.
+
+    By default every object in the result is built as a dict as soon as its
+    fields are resolved. With ``struct_results=True``, each selection is
+    instead lowered to a native struct with one slot and one status flag per
+    alias. The whole result tree is filled in without touching a dict and only
+    converted to dicts in a single pass at the end, using pre-built keys.
+
+    With ``lazy_results=True``, nullable nested objects aren't executed along
+    with their parent. Instead the compiled function for their selection is
+    called when they're first read from the returned ``LazyResult``. Non-null
+    objects are still executed eagerly, down to the nearest nullable field, so
+    that nulls propagate the same way in both modes.
+
+    A Compiler is single-use: it owns one LLVM module and execution engine,
+    so it can only ``compile`` one query, and a second call raises
+    RuntimeError. Separate Compilers can compile concurrently. The function
+    it returns doesn't mutate any shared state, so it can be called from any
+    number of threads at once, each with its own ``errors`` list.
+
+    ``opt_level`` is the level of the LLVM optimization pipeline run on the
+    module before it is compiled to machine code; 0 skips it.
+
+    Queries nested deeper than ``max_depth`` are rejected with a GraphQLError
+    before any code is generated. Below ``inline_depth``, each selection gets
+    its own native function; deeper selections are emitted inline into the
+    function at that depth. This applies to every native function the
+    struct layout uses too, and releasing a result struct takes a single
+    function. So in every mode the compiled code never nests more than
+    ``inline_depth`` native calls, even with ``max_depth=None``. In lazy
+    mode that holds for each deferred object, since those are resolved from
+    Python.
+    """
+
+    def __init__(
+        self,
+        *,
+        struct_results: bool = False,
+        lazy_results: bool = False,
+        opt_level: int = 0,
+        max_depth: t.Optional[int] = 128,
+        inline_depth: int = 8,
+    ):
+        if struct_results and lazy_results:
+            raise ValueError("struct_results and lazy_results can't be combined")
         _init_llvm_bindings()
-        self._target_machine = llvm.Target.from_default_triple().create_target_machine()
-        self._engine = llvm.create_mcjit_compiler(
-            llvm.parse_assembly(""), self._target_machine
-        )
+        with _llvm_lock:
+            self._target_machine = (
+                llvm.Target.from_default_triple().create_target_machine()
+            )
+            self._engine = llvm.create_mcjit_compiler(
+                llvm.parse_assembly(""), self._target_machine
+            )
+            self._engine.set_object_cache(self._on_object_compiled)
         self._ir_context = ir.Context()
         self._module = ir.Module(context=self._ir_context)
         self._pyapi = _pyapi.make(self._ir_context, self._module)
-
-        self._do_not_gc = []
+        self._struct_results = struct_results
+        self._lazy_results = lazy_results
+        self._opt_level = opt_level
+        self._max_depth = max_depth
+        self._inline_depth = inline_depth
+        self._lock = threading.Lock()
+        self._used = False
+        # The llvm.ModuleRef that was compiled, once finalized
+        self._llvm_module: t.Any = None
+        self._timings: t.Dict[str, float] = {}
+        self._code_size = 0
+
+        self._do_not_gc: t.List[t.Any] = []
+        self._executors: t.Dict[str, t.Optional[t.Callable[..., t.Any]]] = {}
+        # Each field that can record an error, indexed by its path ID
+        self._error_sites: t.List[_ErrorSite] = []
+
+    def lower(
+        self,
+        root_type: GraphQLObjectType,
+        fields: t.List[FieldNode],
+        variable_values: t.Optional[t.Dict[str, t.Any]] = None,
+    ) -> ObjectField:
+        """``convert_graphql_query``, timed as part of this compilation."""
+        with self._timed("lowering"):
+            return convert_graphql_query(root_type, fields, variable_values)
 
     def compile(self, query: ObjectField):
-        pyfunc = self._compile(query)
-        # print(self.llvm_ir())
-        # print(self.asm())
-        return pyfunc
+        with self._lock:
+            if self._used:
+                raise RuntimeError(
+                    "a Compiler can only compile one query; create a new one"
+                )
+            self._used = True
+        return self._compile(query)
 
     def llvm_ir(self) -> str:
         return str(self._module)
 
+    def optimized_llvm_ir(self) -> str:
+        """The IR that was compiled to machine code, after optimization."""
+        if self._llvm_module is None:
+            raise RuntimeError("the module hasn't been finalized yet")
+        return str(self._llvm_module)
+
     def asm(self, verbose=True) -> str:
-        self._target_machine.set_asm_verbosity(verbose)
-        asm: str = self._target_machine.emit_assembly(llvm.parse_assembly(self.llvm_ir))
+        with _llvm_lock:
+            if self._llvm_module is None:
+                module = llvm.parse_assembly(self.llvm_ir())
+            else:
+                module = self._llvm_module
+            self._target_machine.set_asm_verbosity(verbose)
+            asm: str = self._target_machine.emit_assembly(module)
         return asm
 
     def finalize(self):
-        module = llvm.parse_assembly(str(self._module))
-        module.verify()
-        self._engine.add_module(module)
-        self._engine.finalize_object()
-        self._engine.run_static_constructors()
+        with _llvm_lock:
+            with self._timed("parse_verify"):
+                module = llvm.parse_assembly(str(self._module))
+                module.verify()
+            if self._opt_level > 0:
+                with self._timed("optimize"):
+                    pmb = llvm.create_pass_manager_builder()
+                    pmb.opt_level = self._opt_level
+                    pm = llvm.create_module_pass_manager()
+                    pmb.populate(pm)
+                    pm.run(module)
+            with self._timed("finalize"):
+                self._engine.add_module(module)
+                self._engine.finalize_object()
+                self._engine.run_static_constructors()
+            self._llvm_module = module
+
+    def stats(self) -> CompileStats:
+        return CompileStats(
+            timings=dict(self._timings),
+            code_size=self._code_size,
+            function_count=sum(
+                1 for func in self._module.functions if not func.is_declaration
+            ),
+        )
+
+    @contextlib.contextmanager
+    def _timed(self, phase: str) -> t.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._timings[phase] = self._timings.get(phase, 0.0) + elapsed
+
+    def _on_object_compiled(self, module, buffer: bytes) -> None:
+        self._code_size += len(buffer)
 
     # FIXME: maintain path to where we're at for compilation error reporting
     def _compile(self, query: ObjectField):
-        top_func = self._compile_selection("query", query, ("query",))
+        if self._max_depth is not None and query.cost.depth > self._max_depth:
+            raise GraphQLError(
+                f"Query has a depth of {query.cost.depth},"
+                f" more than the maximum of {self._max_depth}."
+            )
+
+        with self._timed("ir_build"):
+            if self._struct_results:
+                top_func = self._compile_struct_entry(query, ("query",))
+            else:
+                top_func = self._compile_selection(query, ("query",))
         self.finalize()
 
-        execute_func_ptr = self._engine.get_function_address(top_func.name)
+        with self._timed("finalize"):
+            for name in self._executors:
+                self._executors[name] = self._get_executor(name)
+            execute = self._get_executor(top_func.name)
+        return CompiledQuery(
+            self,
+            execute,
+            lazy_shape=_shape_of(query) if self._lazy_results else None,
+            cost=query.cost,
+            stats=self.stats(),
+        )
+
+    def _get_executor(self, name: str):
+        with _llvm_lock:
+            execute_func_ptr = self._engine.get_function_address(name)
         adapter = ctypes.PYFUNCTYPE(
             ctypes.py_object,
             ctypes.py_object,
@@ -180,35 +667,163 @@ class Compiler:
             ctypes.py_object,
         )(execute_func_ptr)
 
-        def wrapper(root, info, errors, *args, **kwargs):
-            return adapter(root, info, errors)
+        def execute(root, info, errors):
+            # Errors are only located once the compiled code is done, so
+            # that the error path costs no more than two list appends.
+            pending: t.List[t.Any] = []
+            result = adapter(root, info, pending)
+            if pending:
+                errors.extend(self._locate_errors(pending))
+            return result
 
-        return wrapper
+        return execute
 
-    def _compile_selection(
-        self, outer_alias: str, selection: ObjectField, path: tuple[int | str, ...]
+    def _compile_field_resolution(
+        self,
+        irbuilder,
+        field: Field,
+        root,
+        info,
+        errors,
+        path: tuple[int | str, ...],
+        on_fatal: t.Callable[[], None],
+        on_error: t.Callable[[], None],
     ):
-        functions = {}
+        """Call the resolver for ``field`` and return the resolved value.
+
+        ``path`` is the response path of the field, starting with the root
+        selection. If the resolver raises, the ID of that path and the
+        exception are appended to ``errors`` (see ``_locate_errors``) and
+        ``on_error`` is called to finish the block. If it raises something
+        that isn't an ``Exception``, the exception is restored and
+        ``on_fatal`` is called instead. Both callbacks must terminate the
+        block. A ``ConstantField`` evaluates to its value and can't fail.
+        """
+        if isinstance(field, ConstantField):
+            self._do_not_gc.append(field.value)
+            val = ir.Constant(ir.IntType(64), id(field.value)).inttoptr(
+                self._pyapi.PyObject
+            )
+            self._pyapi.incref(irbuilder, val)
+            return val
 
-        for alias, field in selection.selection.items():
-            if isinstance(field, ScalarField):
-                pass
-            elif isinstance(field, ObjectField):
-                functions[alias] = self._compile_selection(alias, field, (*path, alias))
-            else:
-                raise NotImplementedError(field)
+        if field.resolver is not None:
+            callback_ptr, callback_ty = self._get_resolver_callback(field)
+            resolver = irbuilder.inttoptr(ir.IntType(64)(callback_ptr), callback_ty)
+            val = irbuilder.call(resolver, [root, info])
+        else:
+            resolver = self._get_default_resolver()
+            val = irbuilder.call(
+                resolver,
+                [
+                    root,
+                    cstr(irbuilder, f"{field.name}\0".encode("utf-8")),
+                    info,
+                    self._pyapi.PyObject(None),
+                ],
+            )
 
+        resolver_failed = irbuilder.call(
+            self._pyapi.PyErr_GivenExceptionMatches,
+            [val, irbuilder.load(self._pyapi.PyExc_BaseException)],
+        )
+        with irbuilder.if_then(resolver_failed, likely=False):
+            is_fatal_exception = irbuilder.not_(
+                irbuilder.call(
+                    self._pyapi.PyErr_GivenExceptionMatches,
+                    [val, irbuilder.load(self._pyapi.PyExc_Exception)],
+                ),
+            )
+            with irbuilder.if_then(is_fatal_exception, likely=False):
+                irbuilder.call(
+                    self._pyapi.PyErr_Restore,
+                    [
+                        irbuilder.call(self._pyapi.PyObject_Type, [val]),
+                        val,
+                        irbuilder.call(self._pyapi.PyException_GetTraceback, [val]),
+                    ],
+                )
+                on_fatal()
+
+            path_id = self._get_error_path_id(field, path)
+            for item in (path_id, val):
+                append_result = irbuilder.call(
+                    self._pyapi.PyList_Append, [errors, item]
+                )
+                with irbuilder.if_then(
+                    irbuilder.icmp_signed("!=", append_result, _i32(0)), likely=False
+                ):
+                    self._pyapi.decref(irbuilder, val)
+                    on_fatal()
+            self._pyapi.decref(irbuilder, val)
+            on_error()
+
+        return val
+
+    def _compile_selection(self, selection: ObjectField, path: tuple[int | str, ...]):
         func_ty = ir.FunctionType(
             self._pyapi.PyObject,
             (self._pyapi.PyObject, self._pyapi.PyObject, self._pyapi.PyObject),
         )
-        func = ir.Function(self._module, func_ty, f"execute_{outer_alias}")
+        func = ir.Function(self._module, func_ty, _symbol("execute", path))
         irbuilder = ir.IRBuilder(func.append_basic_block("entry"))
         root, info, errors = func.args
         root.name = "root"
         info.name = "info"
         errors.name = "errors"
 
+        def return_null():
+            irbuilder.ret(self._pyapi.PyObject(None))
+
+        def return_none():
+            self._pyapi.incref(irbuilder, self._pyapi.Py_None)
+            irbuilder.ret(self._pyapi.Py_None)
+
+        result_dict = self._compile_selection_body(
+            irbuilder, selection, path, root, info, errors, return_null, return_none
+        )
+        irbuilder.ret(result_dict)
+
+        return func
+
+    def _compile_selection_body(
+        self,
+        irbuilder,
+        selection: ObjectField,
+        path: tuple[int | str, ...],
+        root,
+        info,
+        errors,
+        on_fatal: t.Callable[[], None],
+        on_null: t.Callable[[], None],
+    ):
+        """Emit code that builds the result dict for ``selection`` and return
+        it, leaving the builder at the end of the emitted code.
+
+        ``on_fatal`` is called when a Python exception has been set, and
+        ``on_null`` when the whole object has to be null. Both must terminate
+        the block, and are called after the result dict has been released.
+
+        Object fields at a depth of ``inline_depth`` or more are emitted
+        inline rather than as calls to a function per selection. The selection
+        tree is static, so walking it in one function needs no work list at
+        runtime: the native stack never gets deeper than ``inline_depth``
+        frames, however deep the query, and the deep levels cost no calls.
+        With ``lazy_results``, nullable object fields still get a function of
+        their own, which is only ever called from Python when they're read.
+        """
+        inline = len(path) >= self._inline_depth
+        functions = {}
+
+        for alias, field in selection.selection.items():
+            if isinstance(field, ScalarField):
+                pass
+            elif isinstance(field, ObjectField):
+                if not inline or (self._lazy_results and field.nullable):
+                    functions[alias] = self._compile_selection(field, (*path, alias))
+            else:
+                raise NotImplementedError(field)
+
         aliases = list(selection.selection)
         alias_blocks = {alias: irbuilder.append_basic_block(alias) for alias in aliases}
         end_block = irbuilder.append_basic_block("end")
@@ -216,7 +831,25 @@ class Compiler:
         result_dict = self._pyapi.guarded_call(irbuilder, self._pyapi.PyDict_New, [])
         irbuilder.branch(alias_blocks[aliases[0]])
 
-        # FIXME: Py_EnterRecursiveCall?
+        # Cleanup is emitted once per selection and branched to, so each
+        # inlined level only adds its own cleanup instead of repeating that of
+        # all its ancestors.
+        cleanup_blocks: t.Dict[str, t.Any] = {}
+
+        def cleanup_then(name: str, then: t.Callable[[], None]):
+            if name not in cleanup_blocks:
+                cleanup_blocks[name] = block = irbuilder.append_basic_block(name)
+                with irbuilder.goto_block(block):
+                    self._pyapi.decref(irbuilder, result_dict)
+                    then()
+            irbuilder.branch(cleanup_blocks[name])
+
+        def return_null():
+            cleanup_then("fatal", on_fatal)
+
+        def return_none():
+            cleanup_then("null", on_null)
+
         for alias, next_alias in itertools.pairwise(aliases + [None]):
             assert isinstance(alias, str)
             assert isinstance(next_alias, (str, type(None)))
@@ -226,85 +859,7 @@ class Compiler:
             field = selection.selection[alias]
             irbuilder.position_at_end(block)
 
-            if field.resolver is not None:
-                callback_ptr, callback_ty = self._get_resolver_callback(field)
-                resolver = irbuilder.inttoptr(ir.IntType(64)(callback_ptr), callback_ty)
-                val = irbuilder.call(resolver, [root, info])
-            else:
-                resolver = self._get_default_resolver()
-                val = irbuilder.call(
-                    resolver,
-                    [
-                        root,
-                        cstr(irbuilder, f"{field.name}\0".encode("utf-8")),
-                        info,
-                        self._pyapi.PyObject(None),
-                    ],
-                )
-
-            resolver_failed = irbuilder.call(
-                self._pyapi.PyErr_GivenExceptionMatches,
-                [val, irbuilder.load(self._pyapi.PyExc_BaseException)],
-            )
-            with irbuilder.if_then(resolver_failed, likely=False):
-                is_fatal_exception = irbuilder.not_(
-                    irbuilder.call(
-                        self._pyapi.PyErr_GivenExceptionMatches,
-                        [val, irbuilder.load(self._pyapi.PyExc_Exception)],
-                    ),
-                )
-                with irbuilder.if_then(is_fatal_exception, likely=False):
-                    self._pyapi.decref(irbuilder, result_dict)
-                    irbuilder.call(
-                        self._pyapi.PyErr_Restore,
-                        [
-                            irbuilder.call(self._pyapi.PyObject_Type, [val]),
-                            val,
-                            irbuilder.call(self._pyapi.PyException_GetTraceback, [val]),
-                        ],
-                    )
-                    irbuilder.ret(self._pyapi.PyObject(None))
-
-                (
-                    located_error_func,
-                    located_error_ty,
-                ) = self._get_graphql_core_located_error_fn()
-
-                path_fmt = "".join(
-                    "s" if isinstance(part, str) else "l" for part in path
-                )
-                path_llvm_parts = [
-                    cstr(irbuilder, f"{part}\0".encode("utf-8"))
-                    if isinstance(part, str)
-                    else ir.IntType(64)(part)
-                    for part in path
-                ]
-                path_sequence = self._pyapi.guarded_call(
-                    irbuilder,
-                    self._pyapi.Py_BuildValue,
-                    [
-                        cstr(irbuilder, f"({path_fmt})\0".encode("ascii")),
-                        *path_llvm_parts,
-                    ],
-                )
-
-                self._pyapi.incref(irbuilder, self._pyapi.Py_None)
-                located_error = irbuilder.call(
-                    irbuilder.inttoptr(
-                        ir.IntType(64)(located_error_func), located_error_ty
-                    ),
-                    [val, self._pyapi.Py_None, path_sequence],
-                )
-                self._pyapi.decref(irbuilder, val)
-                self._pyapi.decref(irbuilder, path_sequence)
-
-                self._pyapi.guarded_call(
-                    irbuilder,
-                    self._pyapi.PyList_Append,
-                    [errors, located_error],
-                    error_sentinel=_i32(-1),
-                )
-
+            def set_none(alias=alias):
                 self._pyapi.guarded_call(
                     irbuilder,
                     self._pyapi.PyDict_SetItemString,
@@ -315,12 +870,24 @@ class Compiler:
                     ],
                     error_sentinel=_i32(-1),
                 )
+
+            def on_error(field=field, next_block=next_block, set_none=set_none):
+                set_none()
                 if field.nullable:
                     irbuilder.branch(next_block)
                 else:
-                    self._pyapi.decref(irbuilder, result_dict)
-                    self._pyapi.incref(irbuilder, self._pyapi.Py_None)
-                    irbuilder.ret(self._pyapi.Py_None)
+                    return_none()
+
+            val = self._compile_field_resolution(
+                irbuilder,
+                field,
+                root,
+                info,
+                errors,
+                (*path, alias),
+                return_null,
+                on_error,
+            )
 
             if isinstance(field, ScalarField):
                 self._pyapi.guarded_call(
@@ -331,6 +898,81 @@ class Compiler:
                 )
                 self._pyapi.decref(irbuilder, val)
             elif isinstance(field, ObjectField):
+                with irbuilder.if_then(
+                    irbuilder.icmp_unsigned("==", val, self._pyapi.Py_None),
+                    likely=False,
+                ):
+                    self._pyapi.decref(irbuilder, val)
+                    set_none()
+                    if field.nullable:
+                        irbuilder.branch(next_block)
+                    else:
+                        return_none()
+
+                if self._lazy_results and field.nullable:
+                    callback_ptr, callback_ty = self._get_deferred_callback(
+                        functions[alias].name
+                    )
+                    deferred = irbuilder.call(
+                        irbuilder.inttoptr(ir.IntType(64)(callback_ptr), callback_ty),
+                        [val],
+                    )
+                    self._pyapi.decref(irbuilder, val)
+                    self._pyapi.guarded_call(
+                        irbuilder,
+                        self._pyapi.PyDict_SetItemString,
+                        [
+                            result_dict,
+                            cstr(irbuilder, f"{alias}\0".encode("utf-8")),
+                            deferred,
+                        ],
+                        error_sentinel=_i32(-1),
+                    )
+                    self._pyapi.decref(irbuilder, deferred)
+                    irbuilder.branch(next_block)
+                    continue
+
+                if inline:
+
+                    def inner_fatal(val=val):
+                        self._pyapi.decref(irbuilder, val)
+                        return_null()
+
+                    def inner_null(
+                        val=val, field=field, next_block=next_block, set_none=set_none
+                    ):
+                        self._pyapi.decref(irbuilder, val)
+                        set_none()
+                        if field.nullable:
+                            irbuilder.branch(next_block)
+                        else:
+                            return_none()
+
+                    inner_result = self._compile_selection_body(
+                        irbuilder,
+                        field,
+                        (*path, alias),
+                        val,
+                        info,
+                        errors,
+                        inner_fatal,
+                        inner_null,
+                    )
+                    self._pyapi.decref(irbuilder, val)
+                    self._pyapi.guarded_call(
+                        irbuilder,
+                        self._pyapi.PyDict_SetItemString,
+                        [
+                            result_dict,
+                            cstr(irbuilder, f"{alias}\0".encode("utf-8")),
+                            inner_result,
+                        ],
+                        error_sentinel=_i32(-1),
+                    )
+                    self._pyapi.decref(irbuilder, inner_result)
+                    irbuilder.branch(next_block)
+                    continue
+
                 inner_result = irbuilder.call(
                     functions[alias], [val, info, errors], name=f"{alias}_ok"
                 )
@@ -342,8 +984,7 @@ class Compiler:
                     ),
                     likely=False,
                 ):
-                    self._pyapi.decref(irbuilder, result_dict)
-                    irbuilder.ret(self._pyapi.PyObject(None))
+                    return_null()
                 self._pyapi.guarded_call(
                     irbuilder,
                     self._pyapi.PyDict_SetItemString,
@@ -361,10 +1002,8 @@ class Compiler:
                         ),
                         likely=False,
                     ):
-                        self._pyapi.incref(irbuilder, self._pyapi.Py_None)
-                        self._pyapi.decref(irbuilder, result_dict)
                         self._pyapi.decref(irbuilder, inner_result)
-                        irbuilder.ret(self._pyapi.Py_None)
+                        return_none()
                 self._pyapi.decref(irbuilder, inner_result)
             else:
                 raise NotImplementedError(field)
@@ -372,28 +1011,473 @@ class Compiler:
             irbuilder.branch(next_block)
 
         irbuilder.position_at_end(end_block)
+        return result_dict
+
+    def _get_result_struct(self, selection: ObjectField, path: tuple[int | str, ...]):
+        """Get the native layout for the result of ``selection``.
+
+        The struct starts with an array holding one ``_FIELD_*`` status byte
+        per alias, followed by one slot per alias in selection order. Scalar
+        slots hold a PyObject pointer, and object slots embed the child
+        selection's struct directly, so a whole result tree is one
+        fixed-size block.
+        """
+        struct = self._ir_context.get_identified_type(_symbol("result", path))
+        if struct.is_opaque:
+            slots: t.List[t.Any] = []
+            for alias, field in selection.selection.items():
+                if isinstance(field, ScalarField):
+                    slots.append(self._pyapi.PyObject)
+                elif isinstance(field, ObjectField):
+                    slots.append(self._get_result_struct(field, (*path, alias)))
+                else:
+                    raise NotImplementedError(field)
+            struct.set_body(ir.ArrayType(_i8, len(slots)), *slots)
+        return struct
+
+    def _compile_struct_entry(
+        self, selection: ObjectField, path: tuple[int | str, ...]
+    ):
+        """Compile the top-level function for ``struct_results`` mode.
+
+        It has the same signature as the functions from ``_compile_selection``,
+        but fills a result struct on the stack and converts it to dicts once
+        every field has been resolved.
+        """
+        struct = self._get_result_struct(selection, path)
+        fill_func = self._compile_struct_selection(selection, path)
+        materialize_func = self._compile_struct_materialize(selection, path)
+        release_func = self._compile_struct_release(selection, path)
+
+        func_ty = ir.FunctionType(
+            self._pyapi.PyObject,
+            (self._pyapi.PyObject, self._pyapi.PyObject, self._pyapi.PyObject),
+        )
+        func = ir.Function(self._module, func_ty, _symbol("execute", path))
+        irbuilder = ir.IRBuilder(func.append_basic_block("entry"))
+        root, info, errors = func.args
+        root.name = "root"
+        info.name = "info"
+        errors.name = "errors"
+
+        result = irbuilder.alloca(struct, name="result")
+        irbuilder.store(struct(None), result)
+        status = irbuilder.call(fill_func, [root, info, errors, result])
+
+        with irbuilder.if_then(
+            irbuilder.icmp_signed("!=", status, _i32(0)), likely=False
+        ):
+            irbuilder.call(release_func, [result])
+            with irbuilder.if_then(
+                irbuilder.icmp_signed("<", status, _i32(0)), likely=False
+            ):
+                irbuilder.ret(self._pyapi.PyObject(None))
+            self._pyapi.incref(irbuilder, self._pyapi.Py_None)
+            irbuilder.ret(self._pyapi.Py_None)
+
+        result_dict = irbuilder.call(materialize_func, [result])
+        irbuilder.call(release_func, [result])
         irbuilder.ret(result_dict)
 
         return func
 
-    def _get_graphql_core_located_error_fn(self):
-        if hasattr(self, "_graphql_core_located_error"):
-            func, ty = self._graphql_core_located_error
-        else:
-            from graphql.error import located_error
+    def _compile_struct_selection(
+        self, selection: ObjectField, path: tuple[int | str, ...]
+    ):
+        """Compile a function that resolves ``selection`` into its struct.
+
+        The function returns 0 on success, 1 if the object must be null
+        because a non-null field couldn't be resolved, and -1 with a Python
+        exception set on fatal errors. Whatever the outcome, the struct must
+        be released afterwards.
+        """
+        struct = self._get_result_struct(selection, path)
+        func_ty = ir.FunctionType(
+            _i32,
+            (
+                self._pyapi.PyObject,
+                self._pyapi.PyObject,
+                self._pyapi.PyObject,
+                struct.as_pointer(),
+            ),
+        )
+        func = ir.Function(self._module, func_ty, _symbol("fill", path))
+        irbuilder = ir.IRBuilder(func.append_basic_block("entry"))
+        root, info, errors, out = func.args
+        root.name = "root"
+        info.name = "info"
+        errors.name = "errors"
+        out.name = "out"
+
+        def return_fatal():
+            irbuilder.ret(_i32(-1))
+
+        def return_null():
+            irbuilder.ret(_i32(1))
+
+        self._compile_struct_selection_body(
+            irbuilder,
+            selection,
+            path,
+            root,
+            info,
+            errors,
+            out,
+            return_fatal,
+            return_null,
+        )
+        irbuilder.ret(_i32(0))
+
+        return func
+
+    def _compile_struct_selection_body(
+        self,
+        irbuilder,
+        selection: ObjectField,
+        path: tuple[int | str, ...],
+        root,
+        info,
+        errors,
+        out,
+        on_fatal: t.Callable[[], None],
+        on_null: t.Callable[[], None],
+    ) -> None:
+        """Emit code that resolves ``selection`` into the struct at ``out``,
+        leaving the builder at the end of the emitted code.
+
+        ``on_fatal`` is called when a Python exception has been set, and
+        ``on_null`` when the whole object has to be null. Both must terminate
+        the block. As in ``_compile_selection_body``, object fields at a depth
+        of ``inline_depth`` or more are emitted inline.
+
+        A child that fails is left for the release function, which always
+        visits embedded structs, so failing only costs setting a flag.
+        """
+        inline = len(path) >= self._inline_depth
+        functions = {}
+
+        for alias, field in selection.selection.items():
+            if isinstance(field, ScalarField):
+                pass
+            elif isinstance(field, ObjectField):
+                if not inline:
+                    functions[alias] = self._compile_struct_selection(
+                        field, (*path, alias)
+                    )
+            else:
+                raise NotImplementedError(field)
+
+        # Emitted once per selection and branched to, so that inlined levels
+        # don't repeat the exits of all their ancestors
+        exit_blocks: t.Dict[str, t.Any] = {}
+
+        def exit_via(name: str, then: t.Callable[[], None]):
+            if name not in exit_blocks:
+                exit_blocks[name] = block = irbuilder.append_basic_block(name)
+                with irbuilder.goto_block(block):
+                    then()
+            irbuilder.branch(exit_blocks[name])
+
+        def return_fatal():
+            exit_via("fatal", on_fatal)
+
+        def return_null():
+            exit_via("null", on_null)
+
+        def flag_ptr(index: int):
+            return irbuilder.gep(out, [_i32(0), _i32(0), _i32(index)], inbounds=True)
+
+        def slot_ptr(index: int):
+            return irbuilder.gep(out, [_i32(0), _i32(index + 1)], inbounds=True)
+
+        for index, (alias, field) in enumerate(selection.selection.items()):
+            next_block = irbuilder.append_basic_block(f"after_{alias}")
+
+            def on_error(index=index, field=field, next_block=next_block):
+                irbuilder.store(_i8(_FIELD_ERROR), flag_ptr(index))
+                if field.nullable:
+                    irbuilder.branch(next_block)
+                else:
+                    return_null()
+
+            val = self._compile_field_resolution(
+                irbuilder,
+                field,
+                root,
+                info,
+                errors,
+                (*path, alias),
+                return_fatal,
+                on_error,
+            )
+
+            if isinstance(field, ScalarField):
+                irbuilder.store(val, slot_ptr(index))
+                irbuilder.store(_i8(_FIELD_VALUE), flag_ptr(index))
+            elif isinstance(field, ObjectField):
+                with irbuilder.if_then(
+                    irbuilder.icmp_unsigned("==", val, self._pyapi.Py_None),
+                    likely=False,
+                ):
+                    self._pyapi.decref(irbuilder, val)
+                    irbuilder.store(_i8(_FIELD_NULL), flag_ptr(index))
+                    if field.nullable:
+                        irbuilder.branch(next_block)
+                    else:
+                        return_null()
+
+                if inline:
+
+                    def inner_fatal(val=val):
+                        self._pyapi.decref(irbuilder, val)
+                        return_fatal()
+
+                    def inner_null(
+                        val=val, index=index, field=field, next_block=next_block
+                    ):
+                        self._pyapi.decref(irbuilder, val)
+                        irbuilder.store(_i8(_FIELD_NULL), flag_ptr(index))
+                        if field.nullable:
+                            irbuilder.branch(next_block)
+                        else:
+                            return_null()
+
+                    self._compile_struct_selection_body(
+                        irbuilder,
+                        field,
+                        (*path, alias),
+                        val,
+                        info,
+                        errors,
+                        slot_ptr(index),
+                        inner_fatal,
+                        inner_null,
+                    )
+                    self._pyapi.decref(irbuilder, val)
+                else:
+                    status = irbuilder.call(
+                        functions[alias],
+                        [val, info, errors, slot_ptr(index)],
+                        name=f"{alias}_status",
+                    )
+                    self._pyapi.decref(irbuilder, val)
+                    with irbuilder.if_then(
+                        irbuilder.icmp_signed("!=", status, _i32(0)), likely=False
+                    ):
+                        with irbuilder.if_then(
+                            irbuilder.icmp_signed("<", status, _i32(0)), likely=False
+                        ):
+                            return_fatal()
+                        irbuilder.store(_i8(_FIELD_NULL), flag_ptr(index))
+                        if field.nullable:
+                            irbuilder.branch(next_block)
+                        else:
+                            return_null()
+                irbuilder.store(_i8(_FIELD_VALUE), flag_ptr(index))
+            else:
+                raise NotImplementedError(field)
+
+            irbuilder.branch(next_block)
+            irbuilder.position_at_end(next_block)
+
+    def _compile_struct_materialize(
+        self, selection: ObjectField, path: tuple[int | str, ...]
+    ):
+        """Compile a function that converts a filled result struct to a dict.
+
+        The struct is only borrowed; it still has to be released afterwards.
+        """
+        struct = self._get_result_struct(selection, path)
+        func_ty = ir.FunctionType(self._pyapi.PyObject, (struct.as_pointer(),))
+        func = ir.Function(self._module, func_ty, _symbol("materialize", path))
+        irbuilder = ir.IRBuilder(func.append_basic_block("entry"))
+        (result,) = func.args
+        result.name = "result"
+
+        def return_null():
+            irbuilder.ret(self._pyapi.PyObject(None))
+
+        result_dict = self._compile_struct_materialize_body(
+            irbuilder, selection, path, result, return_null
+        )
+        irbuilder.ret(result_dict)
+
+        return func
+
+    def _compile_struct_materialize_body(
+        self,
+        irbuilder,
+        selection: ObjectField,
+        path: tuple[int | str, ...],
+        result,
+        on_fatal: t.Callable[[], None],
+    ):
+        """Emit code that converts the struct at ``result`` to a dict and
+        return it, leaving the builder at the end of the emitted code.
+
+        ``on_fatal`` is called when a Python exception has been set, after
+        the dict has been released, and must terminate the block. Object
+        fields at a depth of ``inline_depth`` or more are emitted inline.
+        """
+        inline = len(path) >= self._inline_depth
+        functions = {}
+
+        for alias, field in selection.selection.items():
+            if isinstance(field, ObjectField) and not inline:
+                functions[alias] = self._compile_struct_materialize(
+                    field, (*path, alias)
+                )
+
+        result_dict = irbuilder.call(self._pyapi.PyDict_New, [])
+        with irbuilder.if_then(
+            irbuilder.icmp_unsigned("==", result_dict, self._pyapi.PyObject(None)),
+            likely=False,
+        ):
+            on_fatal()
 
-            proto = ctypes.PYFUNCTYPE(
-                ctypes.py_object, ctypes.py_object, ctypes.py_object, ctypes.py_object
+        fatal_block = None
+
+        def return_fatal():
+            nonlocal fatal_block
+            # Shared, so inlined levels don't repeat the cleanup of all their
+            # ancestors
+            if fatal_block is None:
+                fatal_block = irbuilder.append_basic_block("fatal")
+                with irbuilder.goto_block(fatal_block):
+                    self._pyapi.decref(irbuilder, result_dict)
+                    on_fatal()
+            irbuilder.branch(fatal_block)
+
+        for index, (alias, field) in enumerate(selection.selection.items()):
+            # Interned so the hash is computed once, at compile time
+            key = sys.intern(alias)
+            self._do_not_gc.append(key)
+            key_ptr = ir.Constant(ir.IntType(64), id(key)).inttoptr(
+                self._pyapi.PyObject
             )
-            func = proto(located_error)
-            ty = ir.FunctionType(
-                self._pyapi.PyObject,
-                [self._pyapi.PyObject, self._pyapi.PyObject, self._pyapi.PyObject],
-            ).as_pointer()
-            self._do_not_gc.append(func)
-            self._graphql_core_located_error = func, ty
 
-        return ctypes.cast(func, ctypes.c_void_p).value, ty
+            flag = irbuilder.load(
+                irbuilder.gep(result, [_i32(0), _i32(0), _i32(index)], inbounds=True)
+            )
+            slot = irbuilder.gep(result, [_i32(0), _i32(index + 1)], inbounds=True)
+            has_value = irbuilder.icmp_unsigned("==", flag, _i8(_FIELD_VALUE))
+            with irbuilder.if_else(has_value) as (then, else_):
+                with then:
+                    if isinstance(field, ScalarField):
+                        value = irbuilder.load(slot)
+                        self._pyapi.incref(irbuilder, value)
+                    elif inline:
+                        assert isinstance(field, ObjectField)
+                        value = self._compile_struct_materialize_body(
+                            irbuilder, field, (*path, alias), slot, return_fatal
+                        )
+                    else:
+                        value = irbuilder.call(functions[alias], [slot])
+                        with irbuilder.if_then(
+                            irbuilder.icmp_unsigned(
+                                "==", value, self._pyapi.PyObject(None)
+                            ),
+                            likely=False,
+                        ):
+                            return_fatal()
+                    then_block = irbuilder.block
+                with else_:
+                    self._pyapi.incref(irbuilder, self._pyapi.Py_None)
+                    else_block = irbuilder.block
+
+            value_phi = irbuilder.phi(self._pyapi.PyObject, name=f"{alias}_value")
+            value_phi.add_incoming(value, then_block)
+            value_phi.add_incoming(self._pyapi.Py_None, else_block)
+
+            set_result = irbuilder.call(
+                self._pyapi.PyDict_SetItem, [result_dict, key_ptr, value_phi]
+            )
+            self._pyapi.decref(irbuilder, value_phi)
+            with irbuilder.if_then(
+                irbuilder.icmp_signed("!=", set_result, _i32(0)), likely=False
+            ):
+                return_fatal()
+
+        return result_dict
+
+    def _compile_struct_release(
+        self, selection: ObjectField, path: tuple[int | str, ...]
+    ):
+        """Compile a function that drops the references held by a result
+        struct and every struct embedded in it, in one function.
+
+        Scalar slots are only touched if their status is ``_FIELD_VALUE``, so
+        it's safe on partially-filled structs. Embedded structs are always
+        visited, since one can hold values even if its own slot ended up
+        null, so the whole struct has to be zeroed before it's filled.
+        """
+        struct = self._get_result_struct(selection, path)
+        func_ty = ir.FunctionType(ir.VoidType(), (struct.as_pointer(),))
+        func = ir.Function(self._module, func_ty, _symbol("release", path))
+        irbuilder = ir.IRBuilder(func.append_basic_block("entry"))
+        (result,) = func.args
+        result.name = "result"
+
+        self._compile_struct_release_body(irbuilder, selection, result)
+        irbuilder.ret_void()
+
+        return func
+
+    def _compile_struct_release_body(self, irbuilder, selection: ObjectField, result):
+        for index, (alias, field) in enumerate(selection.selection.items()):
+            flag_ptr = irbuilder.gep(
+                result, [_i32(0), _i32(0), _i32(index)], inbounds=True
+            )
+            slot = irbuilder.gep(result, [_i32(0), _i32(index + 1)], inbounds=True)
+            if isinstance(field, ScalarField):
+                with irbuilder.if_then(
+                    irbuilder.icmp_unsigned(
+                        "==", irbuilder.load(flag_ptr), _i8(_FIELD_VALUE)
+                    )
+                ):
+                    self._pyapi.decref(irbuilder, irbuilder.load(slot))
+            elif isinstance(field, ObjectField):
+                self._compile_struct_release_body(irbuilder, field, slot)
+            else:
+                raise NotImplementedError(field)
+            irbuilder.store(_i8(_FIELD_UNSET), flag_ptr)
+
+    def _get_error_path_id(self, field: Field, path: tuple[int | str, ...]):
+        """Get a pointer to a Python int identifying the ``_ErrorSite`` of
+        ``field`` in ``_error_sites``."""
+        path_id = len(self._error_sites)
+        # Leave out the root selection, which isn't part of the response
+        self._error_sites.append(_ErrorSite.of_field(field, path[1:]))
+        path_id_obj = int(path_id)
+        self._do_not_gc.append(path_id_obj)
+        return ir.Constant(ir.IntType(64), id(path_id_obj)).inttoptr(
+            self._pyapi.PyObject
+        )
+
+    def _locate_errors(self, pending: t.List[t.Any]) -> t.List[GraphQLError]:
+        """Turn the path IDs and exceptions recorded by the compiled code into
+        GraphQLErrors."""
+        sites = self._error_sites
+        return [
+            sites[path_id].locate(exc)
+            for path_id, exc in zip(pending[::2], pending[1::2])
+        ]
+
+    def _get_deferred_callback(self, execute_func_name: str):
+        executors = self._executors
+        # Filled in with the real function once the module is finalized
+        executors[execute_func_name] = None
+
+        def make_deferred(source):
+            execute = executors[execute_func_name]
+            assert execute is not None
+            return _Deferred(execute, source, self)
+
+        proto = ctypes.CFUNCTYPE(ctypes.py_object, ctypes.py_object)
+        callback = proto(make_deferred)
+        self._do_not_gc.append(callback)
+        llvm_type = ir.FunctionType(self._pyapi.PyObject, (self._pyapi.PyObject,))
+        return ctypes.cast(callback, ctypes.c_void_p).value, llvm_type.as_pointer()
 
     def _get_resolver_callback(self, field):
         def wrapper(*args):
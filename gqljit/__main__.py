@@ -0,0 +1,115 @@
+"""
+Inspect what gqljit generates for a query:
+
+    python -m gqljit inspect schema.py query.graphql
+
+``schema.py`` is run as a script and must define a GraphQLSchema (named
+``schema``, or the only one it defines).
+"""
+
+import argparse
+import json
+import runpy
+import sys
+import typing as t
+
+from graphql import GraphQLSchema, parse
+from graphql.language import FieldNode
+from graphql.utilities import get_operation_ast, get_operation_root_type
+
+from . import Compiler
+
+_sections = ("stats", "ir", "opt-ir", "asm")
+
+
+def _load_schema(path: str) -> GraphQLSchema:
+    namespace = runpy.run_path(path)
+    schema = namespace.get("schema")
+    if isinstance(schema, GraphQLSchema):
+        return schema
+    schemas = [
+        value for value in namespace.values() if isinstance(value, GraphQLSchema)
+    ]
+    if len(schemas) != 1:
+        raise SystemExit(f"{path} must define exactly one GraphQLSchema")
+    return schemas[0]
+
+
+def _print_section(title: str, body: str) -> None:
+    print(f"; ---- {title} ----")
+    print(body.rstrip("\n"))
+    print()
+
+
+def inspect(args: argparse.Namespace) -> None:
+    schema = _load_schema(args.schema)
+    with open(args.query) as f:
+        document = parse(f.read())
+    operation = get_operation_ast(document, args.operation)
+    if operation is None:
+        raise SystemExit("couldn't find the operation to compile")
+    fields = operation.selection_set.selections
+    if not all(isinstance(field, FieldNode) for field in fields):
+        raise SystemExit("only fields are supported at the top level")
+
+    compiler = Compiler(
+        struct_results=args.struct_results,
+        lazy_results=args.lazy_results,
+        opt_level=args.opt_level,
+    )
+    query = compiler.lower(
+        get_operation_root_type(schema, operation),
+        t.cast(t.List[FieldNode], fields),
+        json.loads(args.variables) if args.variables else None,
+    )
+    compiled = compiler.compile(query)
+
+    sections = args.section or _sections
+    if "stats" in sections:
+        stats = compiled.stats
+        lines = [
+            f"{phase}: {seconds * 1000:.3f} ms"
+            for phase, seconds in stats.timings.items()
+        ]
+        lines.append(f"total: {stats.total_time * 1000:.3f} ms")
+        lines.append(f"functions: {stats.function_count}")
+        lines.append(f"code size: {stats.code_size} bytes")
+        for name, value in vars(compiled.cost).items():
+            lines.append(f"{name.replace('_', ' ')}: {value}")
+        _print_section("stats", "\n".join(lines))
+    if "ir" in sections:
+        _print_section("LLVM IR", compiler.llvm_ir())
+    if "opt-ir" in sections:
+        _print_section("optimized LLVM IR", compiler.optimized_llvm_ir())
+    if "asm" in sections:
+        _print_section("assembly", compiler.asm())
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m gqljit")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    inspect_parser = subparsers.add_parser(
+        "inspect", help="compile a query and dump what was generated"
+    )
+    inspect_parser.add_argument("schema", help="Python file defining the schema")
+    inspect_parser.add_argument("query", help="file containing the query")
+    inspect_parser.add_argument("--operation", help="name of the operation to use")
+    inspect_parser.add_argument("--variables", help="variables, as a JSON object")
+    inspect_parser.add_argument("-O", "--opt-level", type=int, default=2)
+    inspect_parser.add_argument("--struct-results", action="store_true")
+    inspect_parser.add_argument("--lazy-results", action="store_true")
+    inspect_parser.add_argument(
+        "--section",
+        action="append",
+        choices=_sections,
+        help="only print this section (can be repeated)",
+    )
+    inspect_parser.set_defaults(func=inspect)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import threading
+import typing as t
+import weakref
+from dataclasses import dataclass
+
+from graphql import graphql_sync
+from graphql.language import FieldNode, OperationDefinitionNode, parse
+from graphql.type import GraphQLSchema
+from graphql.utilities import get_operation_ast, print_schema
+
+__all__ = [
+    "IntrospectionResult",
+    "IntrospectionCache",
+    "introspect",
+    "is_introspection_field",
+    "schema_fingerprint",
+]
+
+_introspection_fields = frozenset(("__schema", "__type", "__typename"))
+
+
+def is_introspection_field(name: str) -> bool:
+    return name in _introspection_fields
+
+
+def schema_fingerprint(schema: GraphQLSchema) -> str:
+    """A hash of everything about ``schema`` that introspection can observe."""
+    return hashlib.sha256(print_schema(schema).encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class IntrospectionResult:
+    """The result of an introspection query.
+
+    Only the whole response is kept, as JSON. ``data`` decodes a new copy on
+    every access, so the caller owns it even though the result is shared by
+    every request that hits the cache.
+    """
+
+    json: bytes
+
+    @classmethod
+    def of_data(cls, data: t.Dict[str, t.Any]) -> "IntrospectionResult":
+        return cls(
+            json=json.dumps({"data": data}, separators=(",", ":")).encode("utf-8")
+        )
+
+    @property
+    def data(self) -> t.Dict[str, t.Any]:
+        data: t.Dict[str, t.Any] = json.loads(self.json)["data"]
+        return data
+
+
+_Key = t.Hashable
+
+
+class IntrospectionCache:
+    """Results of introspection queries against one version of a schema.
+
+    Caches are shared by every schema with the same fingerprint, so a
+    rebuilt but identical schema keeps its results while a changed one starts
+    over. The fingerprint of a schema is computed once, the first time a
+    cache is requested for it; call ``invalidate`` after changing a schema in
+    place.
+    """
+
+    max_entries = 128
+
+    _by_schema: "weakref.WeakKeyDictionary[GraphQLSchema, IntrospectionCache]" = (
+        weakref.WeakKeyDictionary()
+    )
+    _by_fingerprint: "weakref.WeakValueDictionary[str, IntrospectionCache]" = (
+        weakref.WeakValueDictionary()
+    )
+    _caches_lock = threading.Lock()
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self._results: t.Dict[_Key, IntrospectionResult] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_schema(cls, schema: GraphQLSchema) -> "IntrospectionCache":
+        cache = cls._by_schema.get(schema)
+        if cache is not None:
+            return cache
+
+        fingerprint = schema_fingerprint(schema)
+        with cls._caches_lock:
+            cache = cls._by_fingerprint.get(fingerprint)
+            if cache is None:
+                cache = cls._by_fingerprint[fingerprint] = cls(fingerprint)
+            cls._by_schema[schema] = cache
+        return cache
+
+    @classmethod
+    def invalidate(cls, schema: GraphQLSchema) -> None:
+        with cls._caches_lock:
+            cls._by_schema.pop(schema, None)
+
+    def get(
+        self,
+        key: _Key,
+        compute: t.Callable[[], t.Optional[t.Dict[str, t.Any]]],
+    ) -> t.Optional[IntrospectionResult]:
+        """Get the result for ``key``, calling ``compute`` if it's missing.
+
+        If ``compute`` returns None the query failed, and nothing is cached.
+        """
+        result = self._results.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                return result
+
+            data = compute()
+            if data is None:
+                return None
+            result = IntrospectionResult.of_data(data)
+            if len(self._results) >= self.max_entries:
+                del self._results[next(iter(self._results))]
+            self._results[key] = result
+        return result
+
+
+def operation_key(
+    operation: OperationDefinitionNode,
+    variable_values: t.Optional[t.Dict[str, t.Any]],
+) -> t.Optional[_Key]:
+    """Identify an operation by its source text, which includes any fragments
+    it uses, and variables. Returns None if it can't be cached."""
+    if operation.loc is None:
+        return None
+    key = (
+        operation.loc.source.body,
+        operation.loc.start,
+        tuple(sorted((variable_values or {}).items())),
+    )
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def introspect(
+    schema: GraphQLSchema,
+    source: str,
+    variable_values: t.Optional[t.Dict[str, t.Any]] = None,
+    operation_name: t.Optional[str] = None,
+) -> IntrospectionResult:
+    """Run an introspection query, reusing the result for the same query on
+    the same version of ``schema``.
+
+    Raises ValueError if the operation selects anything other than
+    introspection fields or if it fails.
+    """
+    cache = IntrospectionCache.for_schema(schema)
+    key = (source, operation_name, tuple(sorted((variable_values or {}).items())))
+
+    def compute() -> t.Optional[t.Dict[str, t.Any]]:
+        operation = get_operation_ast(parse(source), operation_name)
+        if operation is None or not all(
+            isinstance(selection, FieldNode)
+            and is_introspection_field(selection.name.value)
+            for selection in operation.selection_set.selections
+        ):
+            raise ValueError("not an introspection query")
+        result = graphql_sync(
+            schema,
+            source,
+            variable_values=variable_values,
+            operation_name=operation_name,
+        )
+        if result.errors:
+            raise ValueError(result.errors)
+        return result.data
+
+    result = cache.get(key, compute)
+    assert result is not None
+    return result
@@ -0,0 +1,135 @@
+import threading
+import typing as t
+
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult
+
+__all__ = ["LazyResult", "LazyExecutionResult"]
+
+_Executor = t.Callable[[t.Any, t.Any, t.List[t.Any]], t.Optional[t.Dict[str, t.Any]]]
+# The alias of every object field in a selection, mapped to the shape of its
+# own selection
+Shape = t.Dict[str, "Shape"]
+
+
+class _Deferred:
+    """An object field whose sub-selection hasn't been executed yet."""
+
+    __slots__ = ("execute", "source", "owner")
+
+    def __init__(self, execute: _Executor, source: t.Any, owner: object):
+        self.execute = execute
+        self.source = source
+        # Whatever owns the machine code behind ``execute``, which has to stay
+        # alive until the deferred object is resolved.
+        self.owner = owner
+
+
+class LazyResult(t.Mapping[str, t.Any]):
+    """A read-only view of a query result.
+
+    Scalar fields of an object are resolved up front, but object fields only
+    run their compiled sub-selection the first time they're accessed. The
+    result is memoized, and any errors are appended to the same ``errors``
+    list as the rest of the query.
+
+    Only nullable object fields are deferred. A non-null field that fails
+    inside a deferred object makes that object null, which is as far as the
+    null would have propagated if the query had been executed eagerly.
+    Non-null object fields are executed with their parent, but are still
+    read through a LazyResult, since they can contain deferred fields.
+    ``shape`` says which fields are objects.
+
+    A LazyResult can be read from several threads. Each deferred field is
+    resolved exactly once, by whichever thread reads it first.
+    """
+
+    __slots__ = ("_data", "_info", "_errors", "_shape", "_lock")
+
+    def __init__(
+        self,
+        data: t.Dict[str, t.Any],
+        info: t.Any,
+        errors: t.List[t.Any],
+        shape: Shape,
+    ):
+        self._data = data
+        self._info = info
+        self._errors = errors
+        self._shape = shape
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> t.Any:
+        value = self._data[key]
+        if value is None or isinstance(value, LazyResult) or key not in self._shape:
+            return value
+
+        with self._lock:
+            value = self._data[key]
+            if isinstance(value, _Deferred):
+                value = value.execute(value.source, self._info, self._errors)
+            if value is not None and not isinstance(value, LazyResult):
+                value = LazyResult(value, self._info, self._errors, self._shape[key])
+            self._data[key] = value
+        return value
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{key!r}: {'...' if isinstance(value, _Deferred) else repr(value)}"
+            for key, value in self._data.items()
+        )
+        return f"{type(self).__name__}({{{fields}}})"
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        """Resolve every remaining field and return the result as plain dicts."""
+        result = {}
+        for key in self._data:
+            value = self[key]
+            if isinstance(value, LazyResult):
+                value = value.to_dict()
+            result[key] = value
+        return result
+
+
+class LazyExecutionResult(ExecutionResult):
+    """The result of executing a query with ``lazy_results``.
+
+    Resolving a deferred object can add errors after the result has been
+    built, so ``errors`` is read from the live list of the execution. Like
+    any other ExecutionResult it is None while there are no errors, and
+    sorted the same way graphql-core sorts them otherwise. Each read returns
+    a new list, holding the errors recorded so far.
+    """
+
+    __slots__ = ("_errors",)
+
+    data: t.Optional[LazyResult]  # type: ignore[assignment]
+
+    def __init__(
+        self,
+        data: t.Optional[LazyResult],
+        errors: t.List[GraphQLError],
+        extensions: t.Optional[t.Dict[str, t.Any]] = None,
+    ):
+        super().__init__(None, errors, extensions)
+        self.data = data
+
+    @property
+    def errors(self) -> t.Optional[t.List[GraphQLError]]:
+        # Sorted into a new list, since deferred fields can still be appending
+        # to the live one from other threads
+        errors = sorted(
+            self._errors,
+            key=lambda error: (error.locations or [], error.path or [], error.message),
+        )
+        return errors or None
+
+    @errors.setter
+    def errors(self, errors: t.Optional[t.List[GraphQLError]]) -> None:
+        self._errors = [] if errors is None else errors
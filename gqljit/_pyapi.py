@@ -41,6 +41,7 @@ def make(ctx, mod):
         PyTuple_Pack = pyapi_func("PyTuple_Pack", py_obj, [intptr], varargs=True)
 
         PyDict_New = pyapi_func("PyDict_New", py_obj, [])
+        PyDict_SetItem = pyapi_func("PyDict_SetItem", int32, [py_obj, py_obj, py_obj])
         PyDict_SetItemString = pyapi_func(
             "PyDict_SetItemString", int32, [py_obj, c_str, py_obj]
         )
@@ -1,4 +1,5 @@
 import functools
+import threading
 import typing as t
 import llvmlite.ir as ir
 
@@ -8,6 +9,7 @@ _once_T = t.TypeVar("_once_T", bound=t.Callable[..., t.Any])
 
 def once(func: _once_T) -> _once_T:
     init_result = _nothing
+    lock = threading.Lock()
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
@@ -16,21 +18,33 @@ def once(func: _once_T) -> _once_T:
         if init_result is not _nothing:
             return init_result
 
-        init_result = func(*args, **kwargs)
+        with lock:
+            if init_result is _nothing:
+                init_result = func(*args, **kwargs)
         return init_result
 
     return t.cast(_once_T, wrapper)
 
 
 def cstr(b, bytes_: bytes):
-    ty = ir.ArrayType(ir.IntType(8), len(bytes_))
-    ptr = b.alloca(ty)
-    b.store(ty(bytearray(bytes_)), ptr)
-    return b.bitcast(ptr, ir.IntType(8).as_pointer())
+    # A constant global rather than a stack copy: code that inlines many
+    # selections would otherwise pile up dynamic allocas in one frame.
+    name = f".str.{bytes_.hex()}"
+    ptr = b.module.globals.get(name)
+    if ptr is None:
+        ty = ir.ArrayType(ir.IntType(8), len(bytes_))
+        ptr = ir.GlobalVariable(b.module, ty, name)
+        ptr.initializer = ty(bytearray(bytes_))
+        ptr.global_constant = True
+        ptr.linkage = "private"
+        ptr.unnamed_addr = True
+    return ptr.bitcast(ir.IntType(8).as_pointer())
 
 
-@once
 def _get_printf(mod):
+    existing = mod.globals.get("printf")
+    if existing is not None:
+        return existing
     return ir.Function(
         mod,
         ir.FunctionType(ir.VoidType(), [ir.IntType(8).as_pointer()], var_arg=True),
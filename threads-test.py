@@ -0,0 +1,89 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import graphql as g
+
+import gqljit
+
+N_THREADS = 32
+N_EXECUTIONS = 5000
+N_COMPILATIONS = 200
+
+
+def fail(root, info):
+    raise ValueError(f"failed for {root['name']}")
+
+
+user_type = g.GraphQLObjectType(
+    name="User",
+    fields=lambda: {
+        "name": g.GraphQLField(g.GraphQLString),
+        "broken": g.GraphQLField(g.GraphQLString, resolve=fail),
+        "friend": g.GraphQLField(user_type),
+    },
+)
+
+schema = g.GraphQLSchema(
+    query=g.GraphQLObjectType(
+        name="Query", fields={"viewer": g.GraphQLField(user_type)}
+    ),
+)
+
+query = "{ viewer { name broken friend { name friend { name } } } }"
+
+
+def make_root(i):
+    return {
+        "viewer": {
+            "name": f"user{i}",
+            "friend": {"name": f"friend{i}", "friend": None},
+        }
+    }
+
+
+def check(i, data, errors):
+    expected = {
+        "viewer": {
+            "name": f"user{i}",
+            "broken": None,
+            "friend": {"name": f"friend{i}", "friend": None},
+        }
+    }
+    assert data == expected, (i, data)
+    assert len(errors) == 1, (i, errors)
+    assert errors[0].message == f"failed for user{i}", (i, errors)
+
+
+document = g.parse(query)
+operation = document.definitions[0]
+execute = gqljit.Compiler().compile(
+    gqljit.convert_graphql_query(schema.query_type, operation.selection_set.selections)
+)
+
+
+def run_shared(i):
+    errors = []
+    check(i, execute(make_root(i), None, errors), errors)
+
+
+def run_compiling(i):
+    result = g.graphql_sync(
+        schema,
+        query,
+        root_value=make_root(i),
+        execution_context_class=gqljit.JITExecutionContext,
+    )
+    check(i, result.data, result.errors)
+
+
+with ThreadPoolExecutor(N_THREADS) as pool:
+    for future in [
+        *(pool.submit(run_shared, i) for i in range(N_EXECUTIONS)),
+        *(pool.submit(run_compiling, i) for i in range(N_COMPILATIONS)),
+    ]:
+        future.result()
+
+print(
+    f"{N_EXECUTIONS} shared executions and {N_COMPILATIONS} compilations"
+    f" on {N_THREADS} threads ({threading.active_count()} still alive)"
+)